@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+#
+# Benchmark the tuner itself: run tune_full.py end to end against fake_cc.py and
+# report evaluations per hour, time to reach X% of the optimum and the overhead the
+# tuner adds to every evaluation. Needs nothing but Python and OpenTuner.
+#
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_cc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument('--work-dir', default=None,
+                       help='scratch directory for the benchmark run (default: a new temporary directory)')
+argparser.add_argument('--seed', type=int, default=0, help='seed of the synthetic performance model')
+argparser.add_argument('--compilers', type=int, default=1,
+                       help='number of stand-in compilers, each with its own model, to tune over')
+argparser.add_argument('--flags', type=int, default=40, help='number of synthetic -f flags')
+argparser.add_argument('--params', type=int, default=8, help='number of synthetic --param values')
+argparser.add_argument('--interactions', type=int, default=12, help='number of pairwise flag interactions')
+argparser.add_argument('--ices', type=int, default=1, help='number of flag pairs that crash the compiler')
+argparser.add_argument('--base-time', type=float, default=0.1, help='runtime of the -O3 binary in seconds')
+argparser.add_argument('--noise', type=float, default=0.02, help='sigma of the lognormal run-to-run noise')
+argparser.add_argument('--compile-time', type=float, default=0.05, help='base compile latency in seconds')
+argparser.add_argument('--preprocess-time', type=float, default=0.05, help='preprocessing latency in seconds')
+argparser.add_argument('--stop-after', type=float, default=60, help='tuning budget in seconds')
+argparser.add_argument('--parallelism', type=int, default=4, help='passed through to tune_full.py')
+argparser.add_argument('--targets', default='80,90,95,99', help='comma separated percentages of the optimum to report')
+argparser.add_argument('--aggressive', action='store_true', help='tune the extended space with output verification')
+argparser.add_argument('--verify-rtol', type=float, default=1e-6, help='output tolerance used with --aggressive')
+argparser.add_argument('--tuner-args', nargs=argparse.REMAINDER, default=[],
+                       help='extra arguments for tune_full.py, must come last: --tuner-args --preprocess --no-canonicalize')
+argparser.add_argument('--probe', action='store_true', help='let the tuner probe the flags/params instead of caching them')
+argparser.add_argument('--json', default=None, help='also write the report to this file')
+argparser.add_argument('--keep', action='store_true', help='keep the work directory afterwards')
+
+
+def compiler_name(models, i):
+    return 'fake%d' % i if len(models) > 1 else ''
+
+
+def prepare_work_dir(args, models):
+    if args.work_dir is None:
+        args.work_dir = tempfile.mkdtemp(prefix='bench-tuner-')
+    elif os.path.isdir(args.work_dir) and os.listdir(args.work_dir):
+        # only ever wipe a directory an earlier benchmark run created
+        if not os.path.isfile(os.path.join(args.work_dir, 'bench_tunebase.json')):
+            sys.exit('%s is not empty and not a benchmark work directory, refusing to overwrite it'
+                     % args.work_dir)
+        shutil.rmtree(args.work_dir)
+    if not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+    for i, model in enumerate(models):
+        write_compiler_files(args, model, compiler_name(models, i))
+    with open(os.path.join(args.work_dir, 'bench.cpp'), 'w') as f:
+        f.write('int main() { return 0; }\n')
+    with open(os.path.join(args.work_dir, 'bench_tunebase.json'), 'w') as f:
+        json.dump({'kernel_files': [], 'basic_params': [], 'include_path': [],
+                   'linking_path': [], 'linking_files': ['bench.cpp']}, f, indent=4)
+
+
+def write_compiler_files(args, model, name):
+    suffix = '_' + name if name else ''
+    model_file = os.path.join(os.path.abspath(args.work_dir), 'model%s.json' % suffix)
+    with open(model_file, 'w') as f:
+        json.dump(model, f, indent=4)
+    if name:
+        # one wrapper per compiler, so each gets its own model
+        wrapper = os.path.join(args.work_dir, name)
+        with open(wrapper, 'w') as f:
+            f.write('#!/bin/sh\nFAKE_CC_MODEL=%s exec %s %s "$@"\n'
+                    % (model_file, sys.executable, os.path.join(HERE, 'fake_cc.py')))
+        os.chmod(wrapper, 0o755)
+    # tune_full.py cannot probe param defaults, so they are always provided
+    param_defaults = dict((p, {'default': info['default'], 'min': info['min'], 'max': info['max']})
+                          for p, info in model['params'].items())
+    with open(os.path.join(args.work_dir, 'cc_param_defaults%s.json' % suffix), 'w') as f:
+        json.dump(param_defaults, f)
+    if not args.probe:
+        with open(os.path.join(args.work_dir, 'cc_flags%s.json' % suffix), 'w') as f:
+            json.dump(sorted(model['flags']), f)
+        with open(os.path.join(args.work_dir, 'cc_params%s.json' % suffix), 'w') as f:
+            json.dump(sorted(model['params']), f)
+
+
+def run_tuner(args, models):
+    work_dir = os.path.abspath(args.work_dir)
+    env = dict(os.environ)
+    env['FAKE_CC_LOG'] = os.path.join(work_dir, 'fake_cc.log')
+    if len(models) > 1:
+        compilers = ['--compilers', ','.join('%s=%s' % (name, os.path.join(work_dir, name))
+                                             for name in (compiler_name(models, i) for i in range(len(models))))]
+    else:
+        env['FAKE_CC_MODEL'] = os.path.join(work_dir, 'model.json')
+        compilers = ['--cc', os.path.join(HERE, 'fake_cc.py')]
+    cmd = [sys.executable, os.path.join(HERE, 'tune_full.py'), 'bench_tunebase.json',
+           '--run-dir', work_dir + '/'] + compilers + [
+           '--compile-template', '{cc} {source} {basic} {include} {linking} -o {output} {flags}',
+           '--database', 'sqlite:///' + os.path.join(work_dir, 'opentuner.db'),
+           '--stop-after', str(args.stop_after),
+           '--parallelism', str(args.parallelism),
+           '--no-dups', '--early-time', '0'] + args.tuner_args
+    if args.aggressive:
+        cmd += ['--aggressive', '--verify-rtol', str(args.verify_rtol)]
+    t0 = time.time()
+    subprocess.check_call(cmd, cwd=work_dir, env=env)
+    return time.time() - t0
+
+
+def load_results(args):
+    from opentuner.resultsdb.connect import connect
+    from opentuner.resultsdb.models import Result, TuningRun
+
+    engine, Session = connect('sqlite:///' + os.path.join(os.path.abspath(args.work_dir), 'opentuner.db'))
+    session = Session()
+    tuning_run = session.query(TuningRun).order_by(TuningRun.id.desc()).first()
+    results = (session.query(Result).filter_by(tuning_run=tuning_run)
+               .order_by(Result.collection_date).all())
+    start = tuning_run.start_date
+    end = tuning_run.end_date or max([r.collection_date for r in results] or [start])
+    rows = [((r.collection_date - start).total_seconds(), r.state, r.configuration.data)
+            for r in results]
+    # opentuner stores local time; the window starts after probing and baselines
+    window = (time.mktime(start.timetuple()) + start.microsecond / 1e6,
+              time.mktime(end.timetuple()) + end.microsecond / 1e6)
+    return window, rows
+
+
+def busy_time(args, window):
+    """
+    Wall time within the tuning window during which at least one compile or benchmark
+    run was active
+    """
+    intervals = []
+    log_file = os.path.join(args.work_dir, 'fake_cc.log')
+    if os.path.isfile(log_file):
+        with open(log_file) as f:
+            for line in f:
+                kind, start, end = line.split()
+                start, end = max(float(start), window[0]), min(float(end), window[1])
+                if start < end:
+                    intervals.append((start, end))
+    busy = 0.0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                busy += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        busy += current_end - current_start
+    return busy, len(intervals)
+
+
+def compiler_config(models, cfg):
+    """
+    The chosen compiler's model and its part of the configuration
+    """
+    if len(models) == 1:
+        return models[0], cfg
+    prefix = cfg['compiler'] + ':'
+    compiler_cfg = dict((k[len(prefix):], v) for k, v in cfg.items() if k.startswith(prefix))
+    compiler_cfg['-O'] = cfg['-O']
+    return models[int(cfg['compiler'][len('fake'):])], compiler_cfg
+
+
+def config_time(models, cfg):
+    """
+    Noise-free runtime of a configuration, picking the chosen compiler's model
+    """
+    return fake_cc.config_time(*compiler_config(models, cfg))
+
+
+def config_key(models, cfg):
+    return (cfg.get('compiler'),) + fake_cc.config_key(*compiler_config(models, cfg))
+
+
+def make_report(args, models, wall_time, window, rows):
+    # the last field summary column carries the largest relative error
+    optimum = min(fake_cc.optimum_time(model, args.aggressive, args.verify_rtol / len(fake_cc.FIELD_SUMMARY))
+                  for model in models)
+    targets = [float(t) for t in args.targets.split(',')]
+    reached = dict((t, None) for t in targets)
+    best = float('inf')
+    # results for configs equivalent to an earlier one are reused by the tuner (or
+    # measured again with --no-canonicalize), so only the first of each counts
+    seen = set()
+    errors = 0
+    for elapsed, state, cfg in rows:
+        key = config_key(models, cfg)
+        if key in seen:
+            continue
+        seen.add(key)
+        if state == 'OK':
+            best = min(best, config_time(models, cfg))
+        else:
+            errors += 1
+        for t in targets:
+            if reached[t] is None and optimum / best * 100.0 >= t:
+                reached[t] = {'seconds': elapsed, 'evaluations': len(seen)}
+    tuning_time = window[1] - window[0]
+    busy, children = busy_time(args, window)
+    evaluations = len(seen)
+    return {
+        'evaluations': evaluations,
+        'errors': errors,
+        'duplicates': len(rows) - evaluations,
+        'wall_time': wall_time,
+        'tuning_time': tuning_time,
+        'evaluations_per_hour': evaluations / tuning_time * 3600 if tuning_time else 0.0,
+        'overhead_per_evaluation': (tuning_time - busy) / evaluations if evaluations else None,
+        'compiles_and_runs': children,
+        'optimum_time': optimum,
+        'best_time': best,
+        'best_percent_of_optimum': optimum / best * 100.0,
+        'time_to_target': dict(('%g%%' % t, reached[t]) for t in targets),
+    }
+
+
+def print_report(report):
+    print('evaluations:            %d (%d failed, %d duplicate results not counted)'
+          % (report['evaluations'], report['errors'], report['duplicates']))
+    print('evaluations per hour:   %.1f' % report['evaluations_per_hour'])
+    if report['overhead_per_evaluation'] is not None:
+        print('overhead per evaluation: %.4f s' % report['overhead_per_evaluation'])
+    print('best / optimum:         %.5f / %.5f s (%.1f%%)'
+          % (report['best_time'], report['optimum_time'], report['best_percent_of_optimum']))
+    for target, hit in sorted(report['time_to_target'].items(), key=lambda x: float(x[0][:-1])):
+        if hit is None:
+            print('time to %-5s of optimum: not reached' % target)
+        else:
+            print('time to %-5s of optimum: %.1f s (%d evaluations)' % (target, hit['seconds'], hit['evaluations']))
+
+
+def main(args):
+    models = [fake_cc.build_model(args.seed + i, args.flags, args.params, args.interactions, args.ices,
+                                  args.base_time, args.noise, args.compile_time, args.preprocess_time)
+              for i in range(args.compilers)]
+    prepare_work_dir(args, models)
+    wall_time = run_tuner(args, models)
+    window, rows = load_results(args)
+    report = make_report(args, models, wall_time, window, rows)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    if args.keep:
+        print('work directory kept in %s' % args.work_dir)
+    else:
+        shutil.rmtree(args.work_dir)
+    return report
+
+
+if __name__ == '__main__':
+    main(argparser.parse_args())
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+#
+# A stand-in for mpicxx/g++ used by bench_tuner.py to benchmark the tuner itself.
+#
+# It accepts the gcc-style command lines that tune_full.py produces (-O<n>, -f<flag>,
+# -fno-<flag>, --param=<name>=<value>, -o <output>) and writes a small executable
+# whose runtime follows a deterministic performance model plus run-to-run noise.
+# Compile latency (including preprocessing, skipped for .i/.ii inputs and done alone
+# with -E) and internal compiler errors are simulated as well; -dM -E lists the
+# predefined macros that -O levels, -ffast-math and -march=native change.
+#
+# The binary prints a CloverLeaf-style " step:" field summary. Fast-math style flags
+# and -ffp-contract=fast perturb it, so output verification can be exercised too.
+#
+# The model is read from the JSON file named by $FAKE_CC_MODEL, or generated from
+# $FAKE_CC_SEED when that is not set. If $FAKE_CC_LOG is set, every compile and
+# every run of a produced binary appends "<kind> <start> <end>" to that file.
+#
+
+from __future__ import division, print_function
+
+import json
+import math
+import os
+import random
+import stat
+import sys
+import time
+
+FAKE_CC_VERSION = 'fake-cc (GCC) 12.2.0'
+
+# Relative runtime of the untuned program at -O0 .. -O3
+OPT_LEVEL_TIMES = [4.0, 1.6, 1.15, 1.0]
+
+# Flags that change numerics: (runtime factor, relative error of the field summary)
+NUMERICS_FLAGS = {
+    '-fassociative-math': (0.97, 1e-10),
+    '-freciprocal-math': (0.98, 1e-9),
+    '-ffinite-math-only': (0.99, 0.0),
+    '-funsafe-math-optimizations': (0.96, 1e-8),
+    '-ffast-math': (0.93, 1e-4),
+}
+
+# -m and other valued options: (runtime factor, relative error of the field summary)
+MACHINE_OPTIONS = {
+    '-march=native': (0.88, 0.0),
+    '-mtune=native': (0.98, 0.0),
+    '-mtune=generic': (1.0, 0.0),
+    '-mprefer-vector-width=128': (1.02, 0.0),
+    '-mprefer-vector-width=256': (0.97, 0.0),
+    '-mprefer-vector-width=512': (0.95, 0.0),
+    '-ffp-contract=off': (1.02, 0.0),
+    '-ffp-contract=on': (1.0, 0.0),
+    '-ffp-contract=fast': (0.98, 1e-12),
+}
+
+FIELD_SUMMARY = [100.0, 200.0, 1.5, 0.25]
+
+# Busy intervals start when the process was forked, not after the interpreter has
+# started, so the stand-in's own startup is not reported as tuner overhead
+BINARY_TEMPLATE = '''#!{python} -S
+import math, os, random, time
+try:
+    with open('/proc/self/stat') as f:
+        started = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+    with open('/proc/uptime') as f:
+        t0 = time.time() - (float(f.read().split()[0]) - started)
+except (IOError, OSError, ValueError, IndexError):
+    t0 = time.time()
+time.sleep({time!r} * math.exp(random.gauss(0.0, {noise!r})))
+print(' step:     10 ' + ' '.join('%.15e' % v for v in {summary!r}))
+if {log!r}:
+    with open({log!r}, 'a') as f:
+        f.write('run %.6f %.6f\\n' % (t0, time.time()))
+'''
+
+
+def process_start_time():
+    """
+    Wall-clock time at which this process was started (same computation as BINARY_TEMPLATE)
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            started = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return time.time() - (float(f.read().split()[0]) - started)
+    except (IOError, OSError, ValueError, IndexError):
+        return time.time()
+
+
+def build_model(seed=0, n_flags=40, n_params=8, n_interactions=12, n_ices=1,
+                base_time=0.1, noise=0.02, compile_time=0.05, preprocess_time=0.05):
+    """
+    Generate a random but reproducible performance model
+    """
+    rng = random.Random(seed)
+    flags = {}
+    for i in range(n_flags):
+        # level: the lowest -O level that enables the flag by default (4 = never)
+        flags['-fstandin-%02d' % i] = {
+            'level': rng.choice([1, 2, 2, 3, 4, 4]),
+            'gain': math.exp(rng.gauss(-0.005, 0.02)),
+        }
+    params = {}
+    for i in range(n_params):
+        default = rng.choice([8, 16, 32, 100, 200, 500, 1000])
+        params['standin-param-%02d' % i] = {
+            'default': default,
+            'min': 0,
+            'max': default * 8,
+            'best': max(1, int(default * math.exp(rng.uniform(-0.69, 0.69)))),
+            'weight': rng.uniform(0.005, 0.03),
+        }
+    names = sorted(flags)
+    interactions = []
+    for _ in range(n_interactions):
+        a, b = rng.sample(names, 2)
+        interactions.append([a, b, math.exp(rng.gauss(0.0, 0.05))])
+    # ICEs depend on the effective flags, so one flag of each pair is off at every -O
+    # level and the baselines and the reference build always compile
+    never = [f for f in names if flags[f]['level'] == 4]
+    ices = []
+    for _ in range(n_ices if never else 0):
+        a = rng.choice(never)
+        ices.append([a, rng.choice([f for f in names if f != a])])
+    for flag, (gain, error) in NUMERICS_FLAGS.items():
+        flags[flag] = {'level': 4, 'gain': gain, 'error': error}
+    options = dict((option, {'gain': gain, 'error': error})
+                   for option, (gain, error) in MACHINE_OPTIONS.items())
+    return {
+        'seed': seed,
+        'base_time': base_time,
+        'noise': noise,
+        'compile_time': compile_time,
+        'preprocess_time': preprocess_time,
+        'flags': flags,
+        'params': params,
+        'options': options,
+        'interactions': interactions,
+        'ices': ices,
+    }
+
+
+def load_model():
+    if os.environ.get('FAKE_CC_MODEL'):
+        with open(os.environ['FAKE_CC_MODEL']) as f:
+            return json.load(f)
+    return build_model(int(os.environ.get('FAKE_CC_SEED', 0)))
+
+
+def effective_flags(model, opt_level, flag_states):
+    """
+    Return the set of flags enabled at opt_level given explicit on/off states
+    """
+    enabled = set()
+    for flag, info in model['flags'].items():
+        state = flag_states.get(flag)
+        if state == 'on' or (state is None and opt_level >= info['level']):
+            enabled.add(flag)
+    return enabled
+
+
+def predict_time(model, opt_level, enabled, param_values, options=()):
+    """
+    Noise-free runtime of a binary built with the given effective flags, params and options
+    """
+    t = model['base_time'] * OPT_LEVEL_TIMES[opt_level]
+    for flag in enabled:
+        t *= model['flags'][flag]['gain']
+    for option in options:
+        t *= model['options'][option]['gain']
+    for a, b, factor in model['interactions']:
+        if a in enabled and b in enabled:
+            t *= factor
+    for param, info in model['params'].items():
+        value = max(1, param_values.get(param, info['default']))
+        t *= 1.0 + info['weight'] * math.log(value / info['best']) ** 2
+    return t
+
+
+def output_error(model, enabled, options=()):
+    return (sum(model['flags'][flag].get('error', 0.0) for flag in enabled) +
+            sum(model['options'][option]['error'] for option in options))
+
+
+def parse_config(model, cfg):
+    """
+    -O level, effective flags and options of a tune_full.py configuration dict (-O 4 means -Ofast)
+    """
+    flag_states = dict((k, v) for k, v in cfg.items() if k in model['flags'] and v != 'default')
+    opt_level = min(cfg['-O'], 3)
+    if cfg['-O'] == 4:
+        flag_states.setdefault('-ffast-math', 'on')
+    options = sorted('%s=%s' % (k, v) for k, v in cfg.items()
+                     if v != 'default' and '%s=%s' % (k, v) in model.get('options', {}))
+    return opt_level, effective_flags(model, opt_level, flag_states), options
+
+
+def config_time(model, cfg):
+    """
+    Noise-free runtime of a tune_full.py configuration dict
+    """
+    opt_level, enabled, options = parse_config(model, cfg)
+    return predict_time(model, opt_level, enabled, cfg, options)
+
+
+def config_key(model, cfg):
+    """
+    Configurations with the same key build the same binary, as in tune_full.py's canonical_key
+    """
+    opt_level, enabled, options = parse_config(model, cfg)
+    params = tuple(sorted((p, cfg[p]) for p in model['params'] if p in cfg))
+    return cfg['-O'], frozenset(enabled), tuple(options), params
+
+
+def optimum_time(model, aggressive=False, max_error=0.0, restarts=20):
+    """
+    Estimate the best reachable runtime by coordinate descent over the flags. Flags
+    and options that change numerics only count with aggressive, and only when their
+    output error stays within max_error.
+    """
+    rng = random.Random(model['seed'])
+    params = dict((p, info['best']) for p, info in model['params'].items())
+    if aggressive:
+        names = sorted(f for f, info in model['flags'].items() if info.get('error', 0.0) <= max_error)
+    else:
+        names = sorted(f for f, info in model['flags'].items() if 'error' not in info)
+    options = []
+    if aggressive:
+        for prefix in set(o.split('=')[0] for o in model.get('options', {})):
+            candidates = [(info['gain'], o) for o, info in model['options'].items()
+                          if o.split('=')[0] == prefix and info['error'] <= max_error and info['gain'] < 1.0]
+            if candidates:
+                options.append(min(candidates)[1])
+    best = float('inf')
+    for opt_level in range(len(OPT_LEVEL_TIMES)):
+        for _ in range(restarts):
+            enabled = set(f for f in names if rng.random() < 0.5)
+            current = predict_time(model, opt_level, enabled, params, options)
+            improved = True
+            while improved:
+                improved = False
+                for flag in names:
+                    enabled ^= {flag}
+                    t = predict_time(model, opt_level, enabled, params, options)
+                    if t < current:
+                        current = t
+                        improved = True
+                    else:
+                        enabled ^= {flag}
+            best = min(best, current)
+    return best
+
+
+def parse_args(argv):
+    opt_level = 0
+    flag_states = {}
+    param_values = {}
+    options = []
+    sources = []
+    output = 'a.out'
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '-o':
+            i += 1
+            output = argv[i]
+        elif arg.startswith('-O'):
+            level = arg[2:] or '1'
+            opt_level = 3 if level in ('fast', 's') else min(int(level), 3)
+            if level == 'fast':
+                flag_states.setdefault('-ffast-math', 'on')
+        elif arg == '--param':
+            i += 1
+            name, value = argv[i].split('=', 1)
+            param_values[name] = int(value)
+        elif arg.startswith('--param='):
+            name, value = arg[len('--param='):].split('=', 1)
+            param_values[name] = int(value)
+        elif arg.startswith('-m') or (arg.startswith('-f') and '=' in arg):
+            options.append(arg)
+        elif arg.startswith('-fno-'):
+            flag_states['-f' + arg[5:]] = 'off'
+        elif arg.startswith('-f'):
+            flag_states[arg] = 'on'
+        elif not arg.startswith('-'):
+            sources.append(arg)
+        i += 1
+    return opt_level, flag_states, param_values, options, sources, output
+
+
+def predefined_macros(model, opt_level, flag_states, options):
+    macros = ['__GNUC__ 12', '__x86_64__ 1']
+    macros.append('__OPTIMIZE__ 1' if opt_level > 0 else '__NO_INLINE__ 1')
+    if '-ffast-math' in effective_flags(model, opt_level, flag_states):
+        macros.append('__FAST_MATH__ 1')
+    if '-march=native' in options:
+        macros.append('__AVX2__ 1')
+    return sorted(macros)
+
+
+def print_help(model, kind, opt_level, flag_states, query):
+    if kind == 'optimizers':
+        print('The following options control optimizations:')
+        enabled = effective_flags(model, opt_level, flag_states)
+        for flag in sorted(model['flags']):
+            if query:
+                print('  %-40s [%s]' % (flag, 'enabled' if flag in enabled else 'disabled'))
+            else:
+                print('  %-40s Stand-in optimization pass.' % flag)
+    elif kind == 'params':
+        print('The following options control parameters:')
+        for param in sorted(model['params']):
+            print('  %-40s Stand-in tuning parameter.' % param)
+
+
+def main(argv):
+    model = load_model()
+    if '--version' in argv:
+        print(FAKE_CC_VERSION)
+        return 0
+    opt_level, flag_states, param_values, options, sources, output = parse_args(argv)
+    for arg in argv:
+        if arg.startswith('--help='):
+            print_help(model, arg[len('--help='):], opt_level, flag_states, '-Q' in argv)
+            return 0
+    if '-dM' in argv and '-E' in argv:
+        for macro in predefined_macros(model, opt_level, flag_states, options):
+            print('#define %s' % macro)
+        return 0
+
+    log_file = os.environ.get('FAKE_CC_LOG', '')
+    t0 = process_start_time()
+    preprocess_time = model.get('preprocess_time', 0.0) * math.exp(random.gauss(0.0, 0.1))
+    if '-E' in argv:
+        time.sleep(preprocess_time)
+        with open(output, 'w') as f:
+            for source in sources:
+                f.write('# 1 "%s"\n' % source)
+        if log_file:
+            with open(log_file, 'a') as f:
+                f.write('preprocess %.6f %.6f\n' % (t0, time.time()))
+        return 0
+    unknown = [f for f in flag_states if f not in model['flags']]
+    if unknown:
+        print('fake-cc: error: unrecognized command-line option %s' % unknown[0], file=sys.stderr)
+        return 1
+    unknown = [o for o in options if o not in model.get('options', {})]
+    if unknown:
+        print('fake-cc: error: unrecognized command-line option %s' % unknown[0], file=sys.stderr)
+        return 1
+    for param, value in param_values.items():
+        info = model['params'].get(param)
+        if info is None or not info['min'] <= value <= info['max']:
+            print('fake-cc: error: invalid --param value %s=%d' % (param, value), file=sys.stderr)
+            return 1
+
+    if not all(os.path.splitext(source)[1] in ('.i', '.ii') for source in sources):
+        time.sleep(preprocess_time)
+    enabled = effective_flags(model, opt_level, flag_states)
+    time.sleep(model['compile_time'] * (1 + 0.25 * opt_level + 0.01 * len(enabled))
+               * math.exp(random.gauss(0.0, 0.1)))
+    if log_file:
+        with open(log_file, 'a') as f:
+            f.write('compile %.6f %.6f\n' % (t0, time.time()))
+    for a, b in model['ices']:
+        if a in enabled and b in enabled:
+            print('fake-cc: internal compiler error: Segmentation fault', file=sys.stderr)
+            return 4
+
+    with open(output, 'w') as f:
+        error = output_error(model, enabled, options)
+        f.write(BINARY_TEMPLATE.format(python=sys.executable, log=log_file, noise=model['noise'],
+                                       time=predict_time(model, opt_level, enabled, param_values, options),
+                                       summary=[v * (1 + error * (i + 1)) for i, v in enumerate(FIELD_SUMMARY)]))
+    os.chmod(output, os.stat(output).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
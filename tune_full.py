@@ -1,21 +1,27 @@
 #!/usr/bin/env python
 from __future__ import division, print_function
-from builtins import map, filter, range
+from builtins import map, range
 from past.utils import old_div
 
 import math
 import argparse
 import ast
+import atexit
 import collections
+import glob
 import json
 import logging
 import opentuner
 import os
 import random
 import re
+import shlex
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 from opentuner.resultsdb.models import Result, TuningRun
 from opentuner.search import manipulator
@@ -24,6 +30,29 @@ from opentuner import tuningrunmain
 FLAGS_WORKING_CACHE_FILE = 'cc_flags.json'
 PARAMS_DEFAULTS_CACHE_FILE = 'cc_param_defaults.json'
 PARAMS_WORKING_CACHE_FILE = 'cc_params.json'
+OPTIONS_WORKING_CACHE_FILE = 'cc_aggressive_options.json'
+
+# Flags from --help=optimizers that can change numerical results, only tuned with --aggressive
+NUMERICS_FLAGS = ['-fassociative-math', '-fcx-fortran-rules', '-fcx-limited-range', '-ffast-math',
+                  '-ffinite-math-only', '-ffloat-store', '-ffp-int-builtin-inexact', '-fmath-errno',
+                  '-freciprocal-math', '-frounding-math', '-fsignaling-nans', '-fsigned-zeros',
+                  '-fsingle-precision-constant', '-ftrapping-math', '-funsafe-math-optimizations']
+
+# Valued options added to the search space with --aggressive (values are probed)
+AGGRESSIVE_OPTIONS = collections.OrderedDict([
+    ('-march', ['native']),
+    ('-mtune', ['native', 'generic']),
+    ('-mprefer-vector-width', ['128', '256', '512']),
+    ('-ffp-contract', ['off', 'on', 'fast']),
+])
+
+# Flags from --help=optimizers that define or remove predefined macros (__NO_INLINE__,
+# __EXCEPTIONS, __SSP__, __GXX_RTTI, ...), for compilers that cannot list them with -dM
+MACRO_FLAGS = ['-fexceptions', '-fhandle-exceptions', '-finline', '-fnon-call-exceptions', '-frtti',
+               '-fshort-wchar', '-fsingle-precision-constant', '-fstack-protector', '-fstack-protector-all',
+               '-fstack-protector-explicit', '-fstack-protector-strong', '-fthreadsafe-statics']
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?')
 
 log = logging.getLogger('gccflags')
 
@@ -39,14 +68,22 @@ argparser.add_argument('--basic', default='', help='a preset basic flags for com
 argparser.add_argument('--saved-name', default=None, help='Saved configuration name')
 argparser.add_argument('--include', default='', help='include paths')
 argparser.add_argument('--linking', default='', help='linking paths')
-argparser.add_argument('--compile-template', default='/usr/bin/mpicxx {source} \
+argparser.add_argument('--compile-template', default='{cc} {source} \
         {basic} {include} {linking} -o {output} -lpthread {flags}', \
         help='command to compile {source} into {output} with {flags}')
+argparser.add_argument('--preprocess-template', default='{cc} -E {basic} {include} {flags} {source} -o {output}',
+                       help='command to preprocess {source} into {output}, used with --preprocess')
+argparser.add_argument('--preprocess', action='store_true',
+                       help='preprocess the sources once and compile every config from the cached output')
+argparser.add_argument('--build-dir', default=None,
+                       help='where binaries are built (default ./tmp, or a directory in /dev/shm with --preprocess)')
 argparser.add_argument('--compile-limit', type=float, default=30,
                        help='kill compiler if it runs more than {default} sec')
 argparser.add_argument('--scaler', type=int, default=4,
                        help='by what factor to try increasing parameters')
 argparser.add_argument('--cc', default='/usr/bin/mpicxx', help='compiler to use')
+argparser.add_argument('--compilers', default=None,
+                       help='comma separated [name=]compiler list to choose from during tuning (overrides --cc)')
 argparser.add_argument('--early-time', type=float, default=0.00001, help="An early stop control time")
 argparser.add_argument('--output', default='./tmp.bin',
                        help='temporary file for compiler to write to')
@@ -58,6 +95,28 @@ argparser.add_argument('--memory-limit', default=1024 ** 3, type=int,
                        help='memory limit for child process')
 argparser.add_argument('--no-cached-flags', action='store_true',
                        help='regenerate the lists of legal flags each time')
+argparser.add_argument('--aggressive', action='store_true',
+                       help='also tune -Ofast, fast-math flags and -march/-mtune/-mprefer-vector-width/-ffp-contract (implies --verify)')
+argparser.add_argument('--verify', action='store_true',
+                       help='reject configs whose output differs from the reference binary')
+argparser.add_argument('--verify-pattern', default=r'^\s*step:',
+                       help='regex selecting the output lines (field summaries, checksums) whose numbers are compared')
+argparser.add_argument('--verify-rtol', type=float, default=1e-6,
+                       help='relative tolerance of the output check')
+argparser.add_argument('--verify-atol', type=float, default=1e-12,
+                       help='absolute tolerance of the output check')
+argparser.add_argument('--no-canonicalize', action='store_true',
+                       help='do not map configs to the effective flag set reported by -Q --help=optimizers')
+argparser.add_argument('--reference-interval', type=int, default=0,
+                       help='re-run the reference binary every N evaluations and normalize results to it (0 = off)')
+argparser.add_argument('--reference-flags', default='-O3',
+                       help='flags of the pinned reference binary used to track machine drift and to verify outputs')
+argparser.add_argument('--reference-runs', type=int, default=3,
+                       help='runs per reference measurement, the median is used')
+argparser.add_argument('--drift-threshold', type=float, default=0.05,
+                       help='relative change of the reference time that marks a measurement window as anomalous')
+argparser.add_argument('--machine-log', default=None,
+                       help='JSON lines file for per-result machine state (default <name>_machine_state.jsonl with --reference-interval)')
 argparser.add_argument('--flags-histogram', action='store_true',
                        help='print out a histogram of flags')
 argparser.add_argument('--flag-importance',
@@ -88,78 +147,325 @@ def read_json_file(args):
     linking_paths = ' '.join(temp_out)
     return linking_files, basic_files, include_paths, linking_paths
 
+class Compiler(object):
+    """
+    A compiler and its probed flag/param space. With several compilers the name
+    prefixes its parameters in the search space and its cache files.
+    """
+    def __init__(self, name, cc):
+        self.name = name
+        self.cc = cc
+        self.prefix = name + ':' if name else ''
+        self.version = None
+        self.flags = []
+        self.options = collections.OrderedDict()
+        self.param_defaults = {}
+        self.params = []
+        self.preprocessed_sources = None
+        self.macros_cache = {}
+        self.macro_sets = {}
+        self.reports_macros = False
+        self.effective_flags_cache = {}
+        self.reports_effective_flags = False
+
+    def cache_file(self, filename):
+        if not self.name:
+            return filename
+        base, ext = os.path.splitext(filename)
+        return '%s_%s%s' % (base, self.name, ext)
+
 class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
     def __init__(self, *pargs, **kwargs):
         super(CloverLeafFlagsTuner, self).__init__(program_name=args.source, *pargs, **kwargs)
-        self.gcc_version = self.extract_gcc_version()
-        self.cc_flags = self.extract_working_flags()
-        self.cc_param_defaults = self.extract_param_defaults()
-        self.cc_params = self.extract_working_params()
+        self.compilers = parse_compilers(args)
+        self.build_dir = self.make_build_dir()
+        self.preprocess_lock = threading.Lock()
+        self.canonicalize = not args.no_canonicalize
+        for compiler in self.compilers:
+            self.setup_compiler(compiler)
         # No need to hardcode the cc_bugs here, just to be consistent with the tutorial
         self.cc_bugs = (['-time'])
         self.result_list = {}
         self.parallel_compile = True
-        try:
-            os.stat('./tmp')
-        except OSError:
-            os.mkdir('./tmp')
+        self.canonical_results = {}
+        self.duplicates = 0
+        self.machine_log = self.get_machine_log()
+        self.verify = args.verify or args.aggressive
+        self.reference_values = None
+        self.reference_times = self.setup_reference()
+        self.runs_since_reference = 0
+        self.drift = 1.0
+        self.drift_anomalous = False
         self.run_baselines()
     
-    def run_baselines(self):
-        log.info("baseline perfs -O0=%.4f -O1=%.4f -O2=%.4f -O3=%.4f",
-                 *[self.run_with_flags(['-O%d' % i], None).time
-                   for i in range(4)])
+    def setup_compiler(self, compiler):
+        compiler.version = self.extract_gcc_version(compiler)
+        if args.preprocess:
+            self.setup_preprocessing(compiler)
+        compiler.flags = [f for f in self.extract_working_flags(compiler)
+                          if args.aggressive or f not in NUMERICS_FLAGS]
+        if args.aggressive:
+            compiler.options = self.extract_working_options(compiler)
+        compiler.param_defaults = self.extract_param_defaults(compiler)
+        compiler.params = self.extract_working_params(compiler)
+        compiler.reports_effective_flags = self.canonicalize and self.check_canonicalize(compiler)
 
-    def extract_gcc_version(self):
-        m = re.search(r'([0-9]+)[.]([0-9]+)[.]([0-9]+)', subprocess.check_output([self.args.cc, '--version']).decode('utf-8'))
+    def run_baselines(self):
+        for compiler in self.compilers:
+            log.info("baseline perfs %s-O0=%.4f -O1=%.4f -O2=%.4f -O3=%.4f", compiler.prefix,
+                     *[self.run_with_flags(['-O%d' % i], None, compiler).time
+                       for i in range(4)])
+
+    def get_machine_log(self):
+        if args.machine_log is None and args.reference_interval > 0:
+            return '{}_machine_state.jsonl'.format(self.args.saved_name[:-18])
+        return args.machine_log
+
+    def setup_reference(self):
+        if args.reference_interval <= 0 and not self.verify:
+            return []
+        if self.compile_with_flags(args.reference_flags.split(), 'reference') != self.compile_results['ok']:
+            if self.verify:
+                log.error("could not build the reference binary to verify outputs against")
+                sys.exit(1)
+            log.warning("could not build the reference binary, drift tracking disabled")
+            return []
+        if self.verify:
+            reference = '%s/%s' % (self.get_tmpdir('reference'), args.output)
+            output = self.call_program([reference], memory_limit=args.memory_limit)['stdout'].decode('utf-8', 'replace')
+            self.reference_values = extract_checksums(output, args.verify_pattern)
+            if not self.reference_values:
+                log.warning("no reference output line matches %r, only the exit status is verified", args.verify_pattern)
+            log.info("verifying %d output values against %s", len(self.reference_values), args.reference_flags)
+        if args.reference_interval <= 0:
+            return []
+        reference_time = self.measure_reference()
+        log.info("reference %s time=%.4f", args.reference_flags, reference_time)
+        return [reference_time]
+
+    def measure_reference(self):
+        reference = '%s/%s' % (self.get_tmpdir('reference'), args.output)
+        times = sorted(self.call_program([reference], memory_limit=args.memory_limit)['time']
+                       for _ in range(args.reference_runs))
+        reference_time = times[len(times) // 2]
+        self.write_machine_log({'kind': 'reference', 'reference_time': reference_time})
+        return reference_time
+
+    def check_drift(self, force=False):
+        # Returns the current runtime factor of the machine relative to the start of the
+        # run, re-measuring the reference binary every --reference-interval evaluations
+        if not self.reference_times:
+            return None
+        self.runs_since_reference += 1
+        if force or self.runs_since_reference >= args.reference_interval:
+            self.runs_since_reference = 0
+            reference_time = self.measure_reference()
+            recent = sorted(self.reference_times[-5:])
+            self.drift_anomalous = abs(reference_time / recent[len(recent) // 2] - 1) > args.drift_threshold
+            self.reference_times.append(reference_time)
+            self.drift = reference_time / self.reference_times[0]
+            log.debug("reference time=%.4f drift=%.4f", reference_time, self.drift)
+        return self.drift
+
+    def write_machine_log(self, record):
+        if self.machine_log is None:
+            return
+        record.update(read_machine_state())
+        record['timestamp'] = time.time()
+        with open(self.machine_log, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def make_build_dir(self):
+        if args.build_dir is None and args.preprocess and os.path.isdir('/dev/shm'):
+            # RAM-backed, so it is removed again when the tuner exits
+            build_dir = tempfile.mkdtemp(prefix='ops-tuner-', dir='/dev/shm')
+            atexit.register(shutil.rmtree, build_dir, True)
+            return build_dir
+        build_dir = args.build_dir or './tmp'
+        try:
+            os.stat(build_dir)
+        except OSError:
+            os.makedirs(build_dir)
+        return build_dir
+
+    def setup_preprocessing(self, compiler):
+        compiler.reports_macros = bool(self.query_predefined_macros(compiler, ['-O0']))
+        if not compiler.reports_macros:
+            log.warning("%s cannot list its predefined macros with -dM -E, configs using flags "
+                        "known to change them compile from the original sources", compiler.cc)
+        compiler.preprocessed_sources = {}
+        for opt in ('-O0', '-O2'):
+            if self.get_sources(compiler, [opt]) == args.source:
+                compiler.preprocessed_sources = None
+                return
+        log.info('preprocessed %d source files into %s', len(args.source.split()),
+                 os.path.join(self.build_dir, 'pp', compiler.name))
+
+    def preprocess_sources(self, compiler, flags):
+        # One variant per set of predefined macros: flags such as -O1 (__OPTIMIZE__),
+        # -fno-inline (__NO_INLINE__) or -fno-exceptions (__EXCEPTIONS) change what the
+        # headers expand to, so the cached sources must match the config being built
+        pp_dir = os.path.join(self.build_dir, 'pp', compiler.name)
+        try:
+            os.stat(pp_dir)
+        except OSError:
+            os.makedirs(pp_dir)
+        variant = len(compiler.preprocessed_sources)
+        flags = ' '.join(f for f in flags if not f.startswith('--param'))
+        outputs = []
+        for i, source in enumerate(args.source.split()):
+            name, ext = os.path.splitext(os.path.basename(source))
+            output = os.path.join(pp_dir, '%d_%d_%s%s' % (variant, i, name, '.i' if ext == '.c' else '.ii'))
+            cmd = args.preprocess_template.format(source=source,
+                    basic=args.basic, include=args.inlcude,
+                    output=output, flags=flags, cc=compiler.cc)
+            pp_result = self.call_program(cmd, limit=args.compile_limit)
+            if pp_result['returncode'] != 0:
+                log.warning("preprocessing %s with %s failed, compiling from the original sources: %s",
+                            source, flags, pp_result['stderr'])
+                return None
+            outputs.append(output)
+        log.debug('preprocessed variant %d for %s', variant, flags)
+        return ' '.join(outputs)
+
+    def query_predefined_macros(self, compiler, flags):
+        # --params never change the predefined macros, so they are left out of the query
+        flags = tuple(f for f in flags if not f.startswith('--param'))
+        if flags not in compiler.macros_cache:
+            cmd = '{} -dM -E {} {} -x {} /dev/null'.format(compiler.cc, args.basic, ' '.join(flags),
+                                                           source_language(args.source))
+            macros, err = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE).communicate()
+            macros = tuple(sorted(set(re.findall(r'^#define .*$', macros.decode('utf-8'), re.MULTILINE))))
+            # configs share few distinct macro sets, keep one copy of each
+            compiler.macros_cache[flags] = compiler.macro_sets.setdefault(macros, macros)
+        return compiler.macros_cache[flags]
+
+    def get_sources(self, compiler, flags):
+        if compiler.preprocessed_sources is None:
+            return args.source
+        if compiler.reports_macros:
+            key = self.query_predefined_macros(compiler, flags)
+        elif any(changes_predefined_macros(f) for f in flags):
+            return args.source
+        else:
+            opt_flags = [f for f in flags if re.match(r'^-O', f)]
+            key = '-O0' if not opt_flags or opt_flags[-1] == '-O0' else '-O2'
+        with self.preprocess_lock:
+            if key not in compiler.preprocessed_sources:
+                compiler.preprocessed_sources[key] = self.preprocess_sources(compiler, flags)
+        return compiler.preprocessed_sources[key] or args.source
+
+    def extract_gcc_version(self, compiler):
+        m = re.search(r'([0-9]+)[.]([0-9]+)[.]([0-9]+)', subprocess.check_output(shlex.split(compiler.cc) + ['--version']).decode('utf-8'))
         if m:
             gcc_version = tuple(map(int, m.group(1, 2, 3)))
         else:
             gcc_version = None
-        log.debug('gcc version %s', gcc_version)
+        log.debug('%s version %s', compiler.cc, gcc_version)
         return gcc_version
 
-    def extract_working_flags(self):
-        if os.path.isfile(FLAGS_WORKING_CACHE_FILE) and not args.no_cached_flags:
-            found_cc_flags = json.load(open(FLAGS_WORKING_CACHE_FILE))
+    def extract_working_flags(self, compiler):
+        cache_file = compiler.cache_file(FLAGS_WORKING_CACHE_FILE)
+        if os.path.isfile(cache_file) and not args.no_cached_flags:
+            found_cc_flags = json.load(open(cache_file))
         else:
-            optimizers, err = subprocess.Popen([self.args.cc, '--help=optimizers'],
+            optimizers, err = subprocess.Popen(shlex.split(compiler.cc) + ['--help=optimizers'],
                                                stdout=subprocess.PIPE).communicate()
             found_cc_flags = re.findall(r'^  (-f[a-z0-9-]+) ', optimizers.decode('utf-8'), re.MULTILINE)
-            log.info('Determining which of %s possible compiler flags work', len(found_cc_flags))
-            found_cc_flags = list(filter(self.check_if_flag_works, found_cc_flags))
-            json.dump(found_cc_flags, open(FLAGS_WORKING_CACHE_FILE, 'w'))
+            log.info('Determining which of %s possible %s flags work', len(found_cc_flags), compiler.cc)
+            found_cc_flags = [f for f in found_cc_flags if self.check_if_flag_works(compiler, f)]
+            if found_cc_flags:
+                json.dump(found_cc_flags, open(cache_file, 'w'))
+            else:
+                # e.g. clang, which has no --help=optimizers
+                log.warning("%s reports no working -f flags, only the -O level is tuned for it", compiler.cc)
         return found_cc_flags
 
-    def extract_param_defaults(self):
-        if os.path.isfile(PARAMS_DEFAULTS_CACHE_FILE) and not args.no_cached_flags:
-            param_defaults = json.load(open(PARAMS_DEFAULTS_CACHE_FILE))
+    def extract_param_defaults(self, compiler):
+        # Per-compiler defaults if there are any, otherwise the shared cache file
+        cache_file = compiler.cache_file(PARAMS_DEFAULTS_CACHE_FILE)
+        if not os.path.isfile(cache_file):
+            cache_file = PARAMS_DEFAULTS_CACHE_FILE
+        if os.path.isfile(cache_file) and not args.no_cached_flags:
+            param_defaults = json.load(open(cache_file))
         else:
             print("Do not support the non cached values")
-            param_defaults = None
+            param_defaults = {}
         return param_defaults
 
-    def extract_working_params(self):
-        params, err = subprocess.Popen([self.args.cc, '--help=params'], stdout=subprocess.PIPE).communicate()
+    def extract_working_params(self, compiler):
+        params, err = subprocess.Popen(shlex.split(compiler.cc) + ['--help=params'], stdout=subprocess.PIPE).communicate()
         params = str(params)
         all_params = re.findall(r'^  ([a-z0-9-]+) ', params, re.MULTILINE)
-        all_params = sorted(set(all_params) & set(self.cc_param_defaults.keys()))
-        if os.path.isfile(PARAMS_WORKING_CACHE_FILE) and not args.no_cached_flags:
-            return json.load(open(PARAMS_WORKING_CACHE_FILE))
+        all_params = sorted(set(all_params) & set(compiler.param_defaults.keys()))
+        cache_file = compiler.cache_file(PARAMS_WORKING_CACHE_FILE)
+        if os.path.isfile(cache_file) and not args.no_cached_flags:
+            return json.load(open(cache_file))
         else:
-            log.info('Determining which of %s possible compiler params work', len(all_params))
+            log.info('Determining which of %s possible %s params work', len(all_params), compiler.cc)
             working_params = []
             for param in all_params:
-                if self.check_if_flag_works('--param={}={}'.format(param, self.cc_param_defaults[param]['default'])):
+                if self.check_if_flag_works(compiler, '--param={}={}'.format(param, compiler.param_defaults[param]['default'])):
                     working_params.append(param)
-            json.dump(working_params, open(PARAMS_WORKING_CACHE_FILE, 'w'))
+            if working_params:
+                json.dump(working_params, open(cache_file, 'w'))
+            else:
+                log.warning("%s reports no working --params, none are tuned for it", compiler.cc)
             return working_params
 
-    def check_if_flag_works(self, flag, try_inverted=True):
+    def extract_working_options(self, compiler):
+        cache_file = compiler.cache_file(OPTIONS_WORKING_CACHE_FILE)
+        if os.path.isfile(cache_file) and not args.no_cached_flags:
+            return collections.OrderedDict(json.load(open(cache_file)))
+        log.info('Determining which of the aggressive options work with %s', compiler.cc)
+        working_options = collections.OrderedDict()
+        for option, values in AGGRESSIVE_OPTIONS.items():
+            values = [v for v in values if self.check_if_flag_works(compiler, '%s=%s' % (option, v), try_inverted=False)]
+            if values:
+                working_options[option] = values
+        json.dump(list(working_options.items()), open(cache_file, 'w'))
+        return working_options
+
+    def query_effective_flags(self, compiler, flags):
+        # The optimizer state gcc reports for this command line, including flags that
+        # are enabled by the -O level or implied/overridden by other flags
+        flags = tuple(flags)
+        if flags not in compiler.effective_flags_cache:
+            cmd = '{} -Q --help=optimizers {} {}'.format(compiler.cc, args.basic, ' '.join(flags))
+            optimizers, err = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                               stderr=subprocess.PIPE).communicate()
+            compiler.effective_flags_cache[flags] = tuple(
+                (name, ' '.join(state.split()))
+                for name, state in re.findall(r'^  (-f\S+)[ \t]+(.*)$', optimizers.decode('utf-8'), re.MULTILINE))
+        return compiler.effective_flags_cache[flags]
+
+    def check_canonicalize(self, compiler):
+        levels = [self.query_effective_flags(compiler, ['-O%d' % i]) for i in range(4)]
+        if not all(levels):
+            log.warning("%s does not report -Q --help=optimizers, only identical flag sets are deduplicated", compiler.cc)
+            return False
+        log.info("canonicalizing %s configs, %d flags differ between -O0 and -O3",
+                 compiler.cc, len(set(levels[0]) - set(levels[3])))
+        return True
+
+    def canonical_key(self, cfg):
+        # Plain -f<flag>/-fno-<flag> switches are replaced by the effective optimizer
+        # state they produce; -O level, --params and valued options are kept verbatim.
+        # Parameters of the compilers that were not chosen never reach the key.
+        compiler = self.cfg_to_compiler(cfg)
+        flags = self.cfg_to_flags(cfg)
+        if not compiler.reports_effective_flags:
+            return compiler.name, tuple(flags)
+        switches = [f for f in flags if re.match(r'^-f[a-z0-9-]+$', f)]
+        others = tuple(f for f in flags if f not in switches)
+        return compiler.name, others, self.query_effective_flags(compiler, [flags[0]] + switches)
+
+    def check_if_flag_works(self, compiler, flag, try_inverted=True):
         # Read in the flags here, a json file perhaps
-        cmd = args.compile_template.format(source=args.source,
+        cmd = args.compile_template.format(source=self.get_sources(compiler, [flag]),
                 basic=args.basic, include=args.inlcude, linking=args.linking,
-                output=args.output, flags=flag, cc=args.cc)
+                output=args.output, flags=flag, cc=compiler.cc)
         compile_result = self.call_program(cmd, limit=args.compile_limit)
         if compile_result['returncode'] != 0:
             log.warning("removing flag %s because it results in compile error", flag)
@@ -171,42 +477,59 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
             log.warning("removing flag {} because renamed".format(flag))
             return False
         if try_inverted and flag[:2] == '-f':
-            if not self.check_if_flag_works(invert_gcc_flag(flag), try_inverted=False):
+            if not self.check_if_flag_works(compiler, invert_gcc_flag(flag), try_inverted=False):
                 log.warning("Odd... {} works but {} does not".format(flag, invert_gcc_flag(flag)))
                 return False
         return True
 
     def manipulator(self):
         m = manipulator.ConfigurationManipulator()
-        m.add_parameter(manipulator.IntegerParameter('-O', 0, 3))
-        for flag in self.cc_flags:
-            m.add_parameter(manipulator.EnumParameter(flag, ['on', 'off', 'default']))
-        for param in self.cc_params:
-            defaults = self.cc_param_defaults[param]
-            if defaults['max'] <= defaults['min']:
-                defaults['max'] = float('inf')
-            defaults['max'] = min(defaults['max'], max(1, defaults['default']) * args.scaler)
-            defaults['min'] = max(defaults['min'], old_div(max(1, defaults['default']), args.scaler))
-
-            if param == 'l1-cache-line-size':
-                m.add_parameter(manipulator.PowerOfTwoParameter(param, 4, 256))
-            elif defaults['max'] > 128:
-                m.add_parameter(manipulator.LogIntegerParameter(param, defaults['min'], defaults['max']))
-            else:
-                m.add_parameter(manipulator.IntegerParameter(param, defaults['min'], defaults['max']))
+        if len(self.compilers) > 1:
+            m.add_parameter(manipulator.EnumParameter('compiler', [c.name for c in self.compilers]))
+        # -O 4 stands for -Ofast
+        m.add_parameter(manipulator.IntegerParameter('-O', 0, 4 if args.aggressive else 3))
+        for compiler in self.compilers:
+            p = compiler.prefix
+            for flag in compiler.flags:
+                m.add_parameter(manipulator.EnumParameter(p + flag, ['on', 'off', 'default']))
+            for option, values in compiler.options.items():
+                m.add_parameter(manipulator.EnumParameter(p + option, ['default'] + values))
+            for param in compiler.params:
+                defaults = compiler.param_defaults[param]
+                if defaults['max'] <= defaults['min']:
+                    defaults['max'] = float('inf')
+                defaults['max'] = min(defaults['max'], max(1, defaults['default']) * args.scaler)
+                defaults['min'] = max(defaults['min'], old_div(max(1, defaults['default']), args.scaler))
+
+                if param == 'l1-cache-line-size':
+                    m.add_parameter(manipulator.PowerOfTwoParameter(p + param, 4, 256))
+                elif defaults['max'] > 128:
+                    m.add_parameter(manipulator.LogIntegerParameter(p + param, defaults['min'], defaults['max']))
+                else:
+                    m.add_parameter(manipulator.IntegerParameter(p + param, defaults['min'], defaults['max']))
 
         return m
 
+    def cfg_to_compiler(self, cfg):
+        if len(self.compilers) == 1:
+            return self.compilers[0]
+        return next(c for c in self.compilers if c.name == cfg['compiler'])
+
     def cfg_to_flags(self, cfg):
-        flags = ['-O%d' % cfg['-O']]
-        for flag in self.cc_flags:
-            if cfg[flag] == 'on':
+        compiler = self.cfg_to_compiler(cfg)
+        p = compiler.prefix
+        flags = ['-Ofast' if cfg['-O'] == 4 else '-O%d' % cfg['-O']]
+        for flag in compiler.flags:
+            if cfg[p + flag] == 'on':
                 flags.append(flag)
-            elif cfg[flag] == 'off':
+            elif cfg[p + flag] == 'off':
                 flags.append(invert_gcc_flag(flag))
+        for option in compiler.options:
+            if cfg[p + option] != 'default':
+                flags.append('%s=%s' % (option, cfg[p + option]))
 
-        for param in self.cc_params:
-            flags.append('--param=%s=%d' % (param, cfg[param]))
+        for param in compiler.params:
+            flags.append('--param=%s=%d' % (param, cfg[p + param]))
 
         for bugset in self.cc_bugs:
             if len(set(bugset) & set(flags)) == len(bugset):
@@ -214,25 +537,42 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
         return flags
 
     def make_command(self, cfg):
-        return args.compile_template.format(source=args.source, 
+        compiler = self.cfg_to_compiler(cfg)
+        flags = self.cfg_to_flags(cfg)
+        return args.compile_template.format(source=self.get_sources(compiler, flags), 
                 basic=args.basic, include=args.inlcude, linking=args.linking,
-                output=args.output, flags=' '.join(self.cfg_to_flags(cfg)), cc=args.cc)
+                output=args.output, flags=' '.join(flags), cc=compiler.cc)
 
     def get_tmpdir(self, result_id):
-        return './tmp/%d' % result_id
+        return '%s/%s' % (self.build_dir, result_id)
 
     def cleanup(self, result_id):
         tmp_dir = self.get_tmpdir(result_id)
-        shutil.rmtree(tmp_dir)
+        # duplicates are never compiled, so there may be nothing to remove
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
     def compile_and_run(self, desired_result, input, limit):
         cfg = desired_result.configuration.data
         compile_result = self.compile(cfg, 0)
         return self.run_precompiled(desired_result, input, limit, compile_result, 0)
 
-    compile_results = {'ok': 0, 'timeout': 1, 'error': 2}
+    compile_results = {'ok': 0, 'timeout': 1, 'error': 2, 'duplicate': 3}
 
     def run_precompiled(self, desired_result, input, limit, compile_result, result_id):
+        key = None
+        if self.canonicalize and desired_result is not None:
+            key = self.canonical_key(desired_result.configuration.data)
+            if key in self.canonical_results:
+                self.duplicates += 1
+                state, run_time = self.canonical_results[key]
+                log.debug("config equivalent to an earlier one, reusing time=%.4f", run_time)
+                return Result(state=state, time=run_time)
+        result = self.measure_precompiled(desired_result, input, limit, compile_result, result_id)
+        if key is not None:
+            self.canonical_results[key] = (result.state or 'OK', result.time)
+        return result
+
+    def measure_precompiled(self, desired_result, input, limit, compile_result, result_id):
         if self.args.force_killall:
             os.system('killall -9 cc1plus 2>/dev/null')
         if compile_result == self.compile_results['timeout']:
@@ -242,6 +582,9 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
 
         tmp_dir = self.get_tmpdir(result_id)
         output_dir = '%s/%s' % (tmp_dir, args.output)
+        if limit == float('inf'):
+            limit = None
+        drift = self.check_drift()
         try:
             run_result = self.call_program([output_dir], limit=limit, memory_limit=args.memory_limit)
         except OSError:
@@ -253,17 +596,49 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
             else:
                 log.error('program error')
                 return Result(state='ERROR', time=float('inf'))
+        if self.verify and not self.output_matches(run_result['stdout']):
+            log.warning("output differs from the reference, rejecting configuration")
+            return Result(state='ERROR', time=float('inf'))
         if run_result['time'] < args.early_time:
             self.manipulator().save_to_file(desired_result.configuration.data, "earlystop_{}_full.json".format(self.args.saved_name[:-18]))
             raise tuningrunmain.CleanStop("Early Stop")
 
-        return Result(time=run_result['time'])
+        run_time = run_result['time']
+        if drift is not None and self.drift_anomalous:
+            log.warning("reference time changed by more than %.0f%%, re-measuring", 100 * args.drift_threshold)
+            drift = self.check_drift(force=True)
+            rerun_result = self.call_program([output_dir], limit=limit, memory_limit=args.memory_limit)
+            if rerun_result['returncode'] == 0:
+                run_time = rerun_result['time']
+            if self.drift_anomalous:
+                log.warning("machine state still unstable, result flagged as anomalous")
+        if desired_result is not None:
+            self.write_machine_log({'kind': 'result',
+                                    'desired_result': desired_result.id,
+                                    'configuration': desired_result.configuration.hash,
+                                    'time': run_time,
+                                    'drift': drift,
+                                    'normalized_time': run_time / drift if drift else run_time,
+                                    'anomalous': bool(drift is not None and self.drift_anomalous)})
+        if drift is not None:
+            return Result(time=run_time / drift)
+        return Result(time=run_time)
+
+    def output_matches(self, stdout):
+        output = stdout.decode('utf-8', 'replace')
+        if re.search(r'\bFAILED\b', output):
+            return False
+        values = extract_checksums(output, args.verify_pattern)
+        if len(values) != len(self.reference_values):
+            return False
+        return all(abs(value - expected) <= args.verify_atol + args.verify_rtol * abs(expected)
+                   for value, expected in zip(values, self.reference_values))
 
-    def debug_gcc_error(self, flags):
+    def debug_gcc_error(self, compiler, flags):
         def fails(subflags):
-            cmd = args.compile_template.format(source=args.source, 
+            cmd = args.compile_template.format(source=self.get_sources(compiler, subflags), 
                 basic=args.basic, include=args.inlcude, linking=args.linking,
-                output=args.output, flags=' '.join(subflags), cc=args.cc)
+                output=args.output, flags=' '.join(subflags), cc=compiler.cc)
             
             compile_result = self.call_program(cmd, limit=args.compile_limit)
             return compile_result['returncode'] != 0
@@ -283,19 +658,23 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
             log.error("compiler crashes/hangs with flags: %s", minimal_flags)
 
     def compile(self, config_data, result_id):
+        if self.canonicalize and self.canonical_key(config_data) in self.canonical_results:
+            return self.compile_results['duplicate']
         flags = self.cfg_to_flags(config_data)
-        return self.compile_with_flags(flags, result_id)
+        return self.compile_with_flags(flags, result_id, self.cfg_to_compiler(config_data))
 
-    def compile_with_flags(self, flags, result_id):
+    def compile_with_flags(self, flags, result_id, compiler=None):
+        # the first compiler builds baselines and the reference binary
+        compiler = compiler or self.compilers[0]
         tmp_dir = self.get_tmpdir(result_id)
         try:
             os.stat(tmp_dir)
         except OSError:
             os.mkdir(tmp_dir)
         output_dir = '%s/%s' % (tmp_dir, args.output)
-        cmd = args.compile_template.format(source=args.source, 
+        cmd = args.compile_template.format(source=self.get_sources(compiler, flags), 
                 basic=args.basic, include=args.inlcude, linking=args.linking,
-                output=output_dir, flags=' '.join(flags), cc=args.cc)
+                output=output_dir, flags=' '.join(flags), cc=compiler.cc)
 
         compile_result = self.call_program(cmd, limit=args.compile_limit, memory_limit=args.memory_limit)
         if compile_result['returncode'] != 0:
@@ -304,14 +683,16 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
                 return self.compile_results['timeout']
             else:
                 log.warning("compiler error %s", compile_result['stderr'])
-                self.debug_gcc_error(flags)
+                self.debug_gcc_error(compiler, flags)
                 return self.compile_results['error']
         return self.compile_results['ok']
 
-    def run_with_flags(self, flags, limit):
-        return self.run_precompiled(None, None, limit, self.compile_with_flags(flags, 0), 0)
+    def run_with_flags(self, flags, limit, compiler=None):
+        return self.run_precompiled(None, None, limit, self.compile_with_flags(flags, 0, compiler), 0)
 
     def save_final_config(self, configuration):
+        if self.canonicalize:
+            log.info("%d configs were equivalent to earlier ones and not re-evaluated", self.duplicates)
         print("Best flags written to {}".format(self.args.saved_name))
         self.manipulator().save_to_file(configuration.data, '{}'.format(self.args.saved_name))
 
@@ -321,19 +702,21 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
         total = q.count()
         for tr in q:
             print(tr.program.name)
+            prefix = self.cfg_to_compiler(tr.final_config.data).prefix
             for flag in self.cfg_to_flags(tr.final_config.data):
-                counter[flag] += old_div(1.0, total)
+                counter[prefix + flag] += old_div(1.0, total)
         print(counter.most_common(20))
 
     def flag_importance(self):
         with open(self.args.flag_importance) as fd:
             best_cfg = json.load(fd)
+        compiler = self.cfg_to_compiler(best_cfg)
         flags = self.cfg_to_flags(best_cfg)
         counter = collections.Counter()
-        baseline_time = self.flags_mean_time(flags)
+        baseline_time = self.flags_mean_time(flags, compiler=compiler)
         for flag in flags[1:]:
             delta_flags = [f for f in flags if f != flag]
-            flag_time = self.flags_mean_time(delta_flags)
+            flag_time = self.flags_mean_time(delta_flags, compiler=compiler)
             impact = max(0.0, flag_time - baseline_time)
             if math.isinf(impact):
                 impact = 0.0
@@ -347,8 +730,8 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
             remaining_impact -= impact
         print(r'{} other flags & {:.1f}% \\\hline'.format(len(flags) - 20, 100.0 * remaining_impact / total_impact))
 
-    def flags_mean_time(self, flags, trials=10):
-        precompiled = self.compile_with_flags(flags, 0)
+    def flags_mean_time(self, flags, trials=10, compiler=None):
+        precompiled = self.compile_with_flags(flags, 0, compiler)
         total = 0.0
         for _ in range(trials):
             total += self.run_precompiled(None, None, None, precompiled, 0).time
@@ -362,6 +745,74 @@ class CloverLeafFlagsTuner(opentuner.measurement.MeasurementInterface):
             self.flag_importance()
             sys.exit(0)
 
+def parse_compilers(args):
+    if not args.compilers:
+        return [Compiler('', args.cc)]
+    compilers = []
+    for item in args.compilers.split(','):
+        name, sep, cc = item.strip().partition('=')
+        if not sep or re.search(r'[\s/]', name):
+            # no name given (or the '=' belongs to e.g. "env OMPI_CXX=g++-12 mpicxx")
+            cc = item.strip()
+            name = os.path.basename(shlex.split(cc)[-1])
+        if name in [c.name for c in compilers]:
+            name = '%s-%d' % (name, len(compilers))
+        compilers.append(Compiler(name, cc))
+    return compilers
+
+def extract_checksums(output, pattern):
+    values = []
+    for line in output.splitlines():
+        if re.search(pattern, line):
+            values.extend(float(x) for x in NUMBER_RE.findall(line))
+    return values
+
+def source_language(sources):
+    return 'c' if all(s.endswith('.c') for s in sources.split()) else 'c++'
+
+def changes_predefined_macros(flag):
+    # Fallback for compilers without -dM: -m options, the numerics flags and MACRO_FLAGS
+    # define or remove macros (__AVX2__, __FAST_MATH__, __NO_INLINE__, __SSP__, ...)
+    if flag.startswith('-m') or flag == '-Ofast':
+        return True
+    if flag.startswith('-f') and '=' not in flag:
+        return flag in NUMERICS_FLAGS + MACRO_FLAGS or invert_gcc_flag(flag) in NUMERICS_FLAGS + MACRO_FLAGS
+    return False
+
+def read_machine_state():
+    state = {'loadavg': None, 'cpu_mhz': None, 'cpu_mhz_min': None, 'temperature': None}
+    try:
+        with open('/proc/loadavg') as f:
+            state['loadavg'] = float(f.read().split()[0])
+    except (IOError, OSError, ValueError):
+        pass
+    freqs = []
+    for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq'):
+        try:
+            with open(path) as f:
+                freqs.append(int(f.read()) / 1000.0)
+        except (IOError, OSError, ValueError):
+            pass
+    if not freqs:
+        try:
+            with open('/proc/cpuinfo') as f:
+                freqs = [float(x) for x in re.findall(r'^cpu MHz\s*:\s*([0-9.]+)', f.read(), re.MULTILINE)]
+        except (IOError, OSError):
+            pass
+    if freqs:
+        state['cpu_mhz'] = sum(freqs) / len(freqs)
+        state['cpu_mhz_min'] = min(freqs)
+    temps = []
+    for path in glob.glob('/sys/class/thermal/thermal_zone*/temp'):
+        try:
+            with open(path) as f:
+                temps.append(int(f.read()) / 1000.0)
+        except (IOError, OSError, ValueError):
+            pass
+    if temps:
+        state['temperature'] = max(temps)
+    return state
+
 def invert_gcc_flag(flag):
     assert flag[:2] == '-f'
     if flag[2:5] != 'no-':